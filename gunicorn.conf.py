@@ -0,0 +1,77 @@
+# Gunicorn settings used by the Procfile and render.yaml (gunicorn wsgi --chdir ./src/ -c gunicorn.conf.py, run from the project root).
+# Every value can be overridden with the environment variables below.
+# Read more about it here: https://docs.gunicorn.org/en/stable/settings.html
+import gc
+import os
+import importlib.util
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def memory_limit_mb():
+    # Container limit first (cgroup v2, then v1), otherwise the memory of the machine
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as file:
+                value = file.read().strip()
+            if value.isdigit() and int(value) < 1 << 50:
+                return int(value) // (1024 * 1024)
+        except OSError:
+            pass
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+def default_workers():
+    # 2 * CPU + 1, but never more than fit in memory
+    workers = 2 * cpu_count() + 1
+    memory = memory_limit_mb()
+    if memory is not None:
+        workers = min(workers, memory // int(os.getenv("WORKER_MEMORY_MB", 150)))
+    return max(1, workers)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent" and importlib.util.find_spec("gevent") is None:
+    worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", default_workers()))
+threads = int(os.getenv("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+
+# Import Flask, SQLAlchemy and Flask-Admin once in the master and share the memory with the workers.
+# Off by default with gevent, which has to monkey patch before the app is imported
+preload_app = os.getenv("GUNICORN_PRELOAD", "false" if worker_class == "gevent" else "true").lower() not in ("0", "false", "no")
+
+# Recycle workers every ~1000 requests to bound memory growth, jitter avoids restarting all at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+def when_ready(server):
+    # Move everything imported by the preload to a permanent generation, so the garbage
+    # collector of the workers doesn't touch (and copy) those pages
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared by the workers: drop the
+    # inherited pools (without closing the parent's sockets) and let each worker open its own
+    if not preload_app:
+        return
+    from app import app
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
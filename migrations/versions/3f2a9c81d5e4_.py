@@ -0,0 +1,43 @@
+"""soft delete: deleted_at and partial indexes
+
+Revision ID: 3f2a9c81d5e4
+Revises: b7d41c2e9f10
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c81d5e4'
+down_revision = 'b7d41c2e9f10'
+branch_labels = None
+depends_on = None
+
+TABLES = ('user', 'character', 'planet', 'vehicle')
+LIVE = sa.text('deleted_at IS NULL')
+DELETED = sa.text('deleted_at IS NOT NULL')
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        op.create_index(f'ix_{table}_deleted', table, ['deleted_at'], unique=False, postgresql_where=DELETED, sqlite_where=DELETED)
+
+    # The email only has to be unique among live users
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_constraint('user_email_key', type_='unique')
+    op.create_index('ix_user_email_live', 'user', ['email'], unique=True, postgresql_where=LIVE, sqlite_where=LIVE)
+
+
+def downgrade():
+    op.drop_index('ix_user_email_live', table_name='user')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_unique_constraint('user_email_key', ['email'])
+
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_deleted', table_name=table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('deleted_at')
@@ -2,29 +2,50 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+from datetime import datetime
 from flask import Flask, request, jsonify, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.exc import IntegrityError
+from utils import APIException, generate_sitemap, serialize_many, get_many, parse_ids
 from admin import setup_admin
 from models import db, User, Character, Planet, Vehicle, Favorite
+from replicas import configure_replicas, setup_replicas, use_primary
+from compression import setup_compression
+from ratelimit import setup_rate_limit
+from graph import parse_include, validate_include, resolve
+from changes import changes_since, parse_token, parse_limit
+from reaper import setup_reaper
+from profiler import setup_profiler
 #from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 
+# Number of proxies in front of the app (1 on Render), so request.remote_addr is the real client
+trusted_proxies = int(os.getenv("TRUSTED_PROXIES", 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
     app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+replica_keys = configure_replicas(app)
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
+setup_replicas(app, replica_keys)
+setup_profiler(app)
 CORS(app)
 setup_admin(app)
+setup_compression(app)
+setup_rate_limit(app)
+setup_reaper(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -63,7 +84,7 @@ def create_character():
 @app.route('/people/edit/<int:people_id>', methods=['PUT'])
 def update_one_people(people_id):
     try:
-        people = Character.query.get(people_id)
+        people = Character.get_live(people_id)
         if people is None:
             return jsonify({"msg": f"People {people_id} not found"}), 404
 
@@ -78,10 +99,12 @@ def update_one_people(people_id):
     except Exception as error:
         return jsonify({"msg": "Error del servidor", "error": str(error)}), 500
 
-#Toda la lista de personajes
+#Toda la lista de personajes (o solo los de ?ids=1,2,3)
 @app.route('/people', methods=['GET'])
 def get_all_people():
-    people = Character.query.all()
+    if "ids" in request.args:
+        return serialize_many(db.session, Character, request.args["ids"]), 200
+    people = Character.live().all()
     people_list = [person.serialize() for person in people]
     return jsonify(people_list), 200
 
@@ -89,7 +112,7 @@ def get_all_people():
 #Solo un personaje según id
 @app.route('/people/<int:people_id>', methods=['GET'])
 def get_people_by_id(people_id):
-    person = Character.query.get(people_id)
+    person = Character.get_live(people_id)
     if person is None:
         return jsonify({"msg": "Character no encontrado"}), 404
     return jsonify(person.serialize()), 200
@@ -98,11 +121,11 @@ def get_people_by_id(people_id):
 @app.route('/people/<int:people_id>', methods=['DELETE'])
 def delete_character(people_id):
     try:
-        character = Character.query.get(people_id)
+        character = Character.get_live(people_id)
         if not character:
             return jsonify({"msg": f"Character {people_id} no encontrado"}), 404
 
-        db.session.delete(character)
+        character.deleted_at = datetime.utcnow()
         db.session.commit()
         return jsonify({"msg": f"Character {people_id} ha sido eliminado satisfactoriamente"}), 200
     except Exception as error:
@@ -134,7 +157,7 @@ def create_one_planet():
 @app.route('/planet/edit/<int:planet_id>', methods=['PUT'])
 def update_one_planet(planet_id):
     try:
-        planet = Planet.query.get(planet_id)
+        planet = Planet.get_live(planet_id)
         if planet is None:
             return jsonify({"msg": f"Planet {planet_id} no encontrado"}), 404
 
@@ -149,17 +172,19 @@ def update_one_planet(planet_id):
     except Exception as error:
         return jsonify({"msg": "Error del servidor", "error": str(error)}), 500
     
-#Todos los planetas
+#Todos los planetas (o solo los de ?ids=1,2,3)
 @app.route('/planets', methods=['GET'])
 def get_all_planets():
-    planets = Planet.query.all()
+    if "ids" in request.args:
+        return serialize_many(db.session, Planet, request.args["ids"]), 200
+    planets = Planet.live().all()
     planet_list = [planet.serialize() for planet in planets]
     return jsonify(planet_list), 200
 
 #Solo un planeta por id
 @app.route('/planets/<int:planet_id>', methods=['GET'])
 def get_planet_by_id(planet_id):
-    planet = Planet.query.get(planet_id)
+    planet = Planet.get_live(planet_id)
     if planet is None:
         return jsonify({"msg": "Planet no encontrado"}), 404
     return jsonify(planet.serialize()), 200
@@ -168,11 +193,11 @@ def get_planet_by_id(planet_id):
 @app.route('/planets/<int:planet_id>', methods=['DELETE'])
 def delete_planet(planet_id):
     try:
-        planet = Planet.query.get(planet_id)
+        planet = Planet.get_live(planet_id)
         if not planet:
             return jsonify({"msg": f"Planet {planet_id} no encontrado"}), 404
 
-        db.session.delete(planet)
+        planet.deleted_at = datetime.utcnow()
         db.session.commit()
         return jsonify({"msg": f"Planet {planet_id} ha sido eliminado satisfactoriamente"}), 200
     except Exception as error:
@@ -194,6 +219,9 @@ def create_user():
         db.session.add(new_user)
         db.session.commit()
         return jsonify({"msg": "User ha sido creado satisfactoriamente"}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"msg": f"El email {body['email']} ya esta registrado"}), 409
     except Exception as error:
         return jsonify({"msg": "Error del servidor", "error": str(error)}), 500
     
@@ -201,7 +229,7 @@ def create_user():
 @app.route('/users/edit/<int:user_id>', methods=['PUT'])
 def update_one_user(user_id):
     try:
-        user = User.query.get(user_id)
+        user = User.get_live(user_id)
         if user is None:
             return jsonify({"msg": f"User {user_id} no encontrado"}), 404
 
@@ -212,13 +240,18 @@ def update_one_user(user_id):
         db.session.commit()
         return user.serialize(), 200
 
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"msg": f"El email {body['email']} ya esta registrado"}), 409
     except Exception as error:
         return jsonify({"msg": "Error del servidor", "error": str(error)}), 500
 
-#Para obtener todos los usuarios
+#Para obtener todos los usuarios (o solo los de ?ids=1,2,3)
 @app.route('/users', methods=['GET'])
 def get_all_users():
-    users = User.query.all()
+    if "ids" in request.args:
+        return serialize_many(db.session, User, request.args["ids"]), 200
+    users = User.live().all()
     user_list = [user.serialize() for user in users]
     return jsonify(user_list), 200
 
@@ -226,7 +259,7 @@ def get_all_users():
 @app.route('/users/<int:user_id>', methods=['GET'])
 def get_one_user(user_id):
     try:
-        user = User.query.get(user_id)
+        user = User.get_live(user_id)
         if user is None:
             return jsonify ({"msg":f"user {user_id} no encontrado"}), 404
         serialize_user = user.serialize()
@@ -238,11 +271,11 @@ def get_one_user(user_id):
 @app.route('/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     try:
-        user = User.query.get(user_id)
+        user = User.get_live(user_id)
         if not user:
             return jsonify({"msg": f"User {user_id} no encontrado"}), 404
 
-        db.session.delete(user)
+        user.deleted_at = datetime.utcnow()
         db.session.commit()
         return jsonify({"msg": f"User {user_id} ha sido eliminado satisfactoriamente"}), 200
     except Exception as error:
@@ -272,7 +305,7 @@ def create_one_vehicle():
 @app.route('/edit/vehicle/<int:vehicle_id>', methods=['PUT'])
 def update_one_vehicle(vehicle_id):
     try:
-        vehicle = Vehicle.query.get(vehicle_id)
+        vehicle = Vehicle.get_live(vehicle_id)
         if vehicle is None:
             return jsonify({"msg": f"Vehicle {vehicle_id} no encontrado"}), 404
 
@@ -287,10 +320,12 @@ def update_one_vehicle(vehicle_id):
     except Exception as error:
         return jsonify({"msg": "Error del servidor", "error": str(error)}), 500
     
-#Para obtener todos los vehiculos
+#Para obtener todos los vehiculos (o solo los de ?ids=1,2,3)
 @app.route('/vehicles', methods=['GET'])
 def get_all_vehicles():
-    vehicles = Vehicle.query.all()
+    if "ids" in request.args:
+        return serialize_many(db.session, Vehicle, request.args["ids"]), 200
+    vehicles = Vehicle.live().all()
     vehicle_list = [vehicle.serialize() for vehicle in vehicles]
     return jsonify(vehicle_list), 200
 
@@ -298,7 +333,7 @@ def get_all_vehicles():
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
 def get_one_vehicle(vehicle_id):
     try:
-        vehicle = Vehicle.query.get(vehicle_id)
+        vehicle = Vehicle.get_live(vehicle_id)
         if vehicle is None:
             return jsonify ({"msg":f"Vehicle {vehicle_id} no encontrado"}), 404
         serialize_vehicle = vehicle.serialize()
@@ -310,11 +345,11 @@ def get_one_vehicle(vehicle_id):
 @app.route('/vehicles/<int:vehicle_id>', methods=['DELETE'])
 def delete_vehicle(vehicle_id):
     try:
-        vehicle = Vehicle.query.get(vehicle_id)
+        vehicle = Vehicle.get_live(vehicle_id)
         if not vehicle:
             return jsonify({"msg": f"Vehicle {vehicle_id} no encontrado"}), 404
 
-        db.session.delete(vehicle)
+        vehicle.deleted_at = datetime.utcnow()
         db.session.commit()
         return jsonify({"msg": f"Vehicle {vehicle_id} ha sido eliminado satisfactoriamente"}), 200
     except Exception as error:
@@ -326,7 +361,7 @@ def delete_vehicle(vehicle_id):
 @app.route('/users/<int:user_id>/favorites', methods=['GET'])
 def get_favorites_of_user_id(user_id):
     try:
-        user = User.query.get(user_id)
+        user = User.get_live(user_id)
         
         if not user:
             return jsonify({"msg": "El usuario no existe"}), 404
@@ -338,10 +373,33 @@ def get_favorites_of_user_id(user_id):
     except Exception as error: 
         return jsonify ({"msg":"Error del servidor", "error": str(error)}), 500
 
+#Usuarios con sus favoritos y entidades en una sola peticion
+#Ejemplo: /users/graph?ids=1,2&include=favorites.character,favorites.planet,favorites.vehicle
+@app.route('/users/graph', methods=['GET'])
+def get_users_graph():
+    include = parse_include(request.args.get("include"))
+    validate_include(User, include)
+    users, missing = get_many(db.session, User, parse_ids(request.args.get("ids", "")))
+    return jsonify({"results": resolve(db.session, User, users, include), "missing": missing}), 200
+
+@app.route('/users/<int:user_id>/graph', methods=['GET'])
+def get_user_graph(user_id):
+    include = parse_include(request.args.get("include"))
+    validate_include(User, include)
+    user = User.get_live(user_id)
+    if user is None:
+        return jsonify({"msg": f"user {user_id} no encontrado"}), 404
+    return jsonify(resolve(db.session, User, [user], include)[0]), 200
+
 #Crear vehiculo favorito
 @app.route('/favorite/vehicle/<int:vehicle_id>/<int:user_id>', methods=['POST'])
 def create_favorite_vehicle(vehicle_id, user_id):
     try:
+        if User.get_live(user_id) is None:
+            return jsonify({"msg": f"User {user_id} no encontrado"}), 404
+        if Vehicle.get_live(vehicle_id) is None:
+            return jsonify({"msg": f"Vehicle {vehicle_id} no encontrado"}), 404
+
         if Favorite.query.filter_by(user_id = user_id,vehicle_id=vehicle_id).first():
             return jsonify({"msg": f"Vehicle {vehicle_id} ya esta agregado a favoritos"}), 404
 
@@ -360,12 +418,17 @@ def create_favorite_vehicle(vehicle_id, user_id):
 @app.route('/favorite/people/<int:people_id>/<int:user_id>', methods=['POST'])
 def create_favorite_people(people_id, user_id):
     try:
-        if Favorite.query.filter_by(user_id = user_id,people_id=people_id).first():
+        if User.get_live(user_id) is None:
+            return jsonify({"msg": f"User {user_id} no encontrado"}), 404
+        if Character.get_live(people_id) is None:
+            return jsonify({"msg": f"People {people_id} no encontrado"}), 404
+
+        if Favorite.query.filter_by(user_id = user_id,character_id=people_id).first():
             return jsonify({"msg": f"People {people_id} ya esta agregado a favoritos"}), 404
 
         new_favorite_people = Favorite(
             user_id=user_id,
-            people_id=people_id
+            character_id=people_id
         )
         db.session.add(new_favorite_people)
         db.session.commit()
@@ -378,6 +441,11 @@ def create_favorite_people(people_id, user_id):
 @app.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['POST'])
 def create_favorite_planet(planet_id, user_id):
     try:
+        if User.get_live(user_id) is None:
+            return jsonify({"msg": f"User {user_id} no encontrado"}), 404
+        if Planet.get_live(planet_id) is None:
+            return jsonify({"msg": f"Planet {planet_id} no encontrado"}), 404
+
         if Favorite.query.filter_by(user_id = user_id,planet_id=planet_id).first():
             return jsonify({"msg": f"Planet {planet_id} ya esta agregado a favoritos"}), 404
 
@@ -444,6 +512,15 @@ def delete_favorite_planet(planet_id, user_id):
         return jsonify({"msg": "Error del servidor", "error": str(error)}), 500
 
 
+#Cambios desde un token para sincronizar clientes sin descargar todas las listas
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    # Replicas lag by different amounts, a token from one could skip changes on another
+    use_primary()
+    since = parse_token(request.args.get("since"))
+    limit = parse_limit(request.args.get("limit"))
+    return jsonify(changes_since(db.session, since, limit)), 200
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,132 @@
+"""
+Negotiated gzip/brotli/zstd compression for the API responses.
+brotli and zstandard are optional, gzip is always available.
+"""
+import os
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/")
+
+def available_encodings():
+    # Ordered by preference when the client accepts several with the same q
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+def compress(encoding, body, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+def compress_stream(encoding, chunks, level):
+    # Flush after every chunk so the client receives data as soon as it is produced
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=min(level, 11))
+        for chunk in chunks:
+            yield compressor.process(_to_bytes(chunk)) + compressor.flush()
+        yield compressor.finish()
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        for chunk in chunks:
+            yield compressor.compress(_to_bytes(chunk)) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(_to_bytes(chunk)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+def _to_bytes(chunk):
+    return chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+class CompressedCache:
+    """LRU of compressed bodies keyed by the digest of the uncompressed payload."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def setup_compression(app):
+    min_size = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+    level = int(os.getenv("COMPRESS_LEVEL", 6))
+    cache = CompressedCache(int(os.getenv("COMPRESS_CACHE_BYTES", 16 * 1024 * 1024)))
+    encodings = available_encodings()
+    app.extensions["compression_cache"] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        if response.direct_passthrough or "Content-Encoding" in response.headers:
+            return response
+        if not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(encoding, response.response, level)
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = encoding
+            return response
+
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress(encoding, body, level)
+            cache.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
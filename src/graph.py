@@ -0,0 +1,63 @@
+"""
+Resolves ?include=favorites.character,favorites.planet style expansions with one
+batched query per relationship level, so the number of queries never depends on
+the number of rows (no N+1).
+"""
+from sqlalchemy import inspect
+from utils import APIException
+
+MAX_INCLUDE_DEPTH = 3
+
+def parse_include(raw):
+    # "favorites.character,favorites.planet" -> {"favorites": {"character": {}, "planet": {}}}
+    tree = {}
+    for path in (raw or "").split(","):
+        names = [name.strip() for name in path.split(".") if name.strip()]
+        if len(names) > MAX_INCLUDE_DEPTH:
+            raise APIException(f"Maximo {MAX_INCLUDE_DEPTH} niveles en include", status_code=400)
+        node = tree
+        for name in names:
+            node = node.setdefault(name, {})
+    return tree
+
+def validate_include(model, tree):
+    relationships = inspect(model).relationships
+    for name, subtree in tree.items():
+        if name not in relationships:
+            raise APIException(f"{model.__name__} no tiene la relacion '{name}'", status_code=400)
+        validate_include(relationships[name].mapper.class_, subtree)
+
+def resolve(session, model, rows, tree):
+    """Serialize rows and attach every relationship in tree, loading one level at a time."""
+    documents = [row.serialize() for row in rows]
+    if not rows:
+        return documents
+
+    mapper = inspect(model)
+    for name, subtree in tree.items():
+        relationship = mapper.relationships[name]
+        target = relationship.mapper.class_
+        local_column, remote_column = relationship.local_remote_pairs[0]
+        local_key = mapper.get_property_by_column(local_column).key
+        remote_key = relationship.mapper.get_property_by_column(remote_column).key
+
+        keys = {getattr(row, local_key) for row in rows} - {None}
+        children = []
+        if keys:
+            query = session.query(target).filter(remote_column.in_(keys))
+            if hasattr(target, "deleted_at"):
+                query = query.filter(target.deleted_at.is_(None))
+            children = query.all()
+        child_documents = resolve(session, target, children, subtree)
+
+        grouped = {}
+        for child, child_document in zip(children, child_documents):
+            grouped.setdefault(getattr(child, remote_key), []).append(child_document)
+
+        for row, document in zip(rows, documents):
+            matches = grouped.get(getattr(row, local_key), [])
+            if relationship.uselist:
+                document[name] = matches
+            else:
+                document[name] = matches[0] if matches else None
+    return documents
@@ -1,10 +1,42 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+class SoftDeleteMixin:
+    # Deleted rows keep existing until the reaper removes their favorites and hard deletes them
+    deleted_at = db.Column(db.DateTime, nullable=True)
+
+    @classmethod
+    def live(cls):
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def get_live(cls, id):
+        instance = cls.query.get(id)
+        if instance is None or instance.deleted_at is not None:
+            return None
+        return instance
+
+def soft_delete_indexes(table):
+    # Partial index over the deleted rows only, it stays tiny and is what the reaper scans
+    return (
+        db.Index(f"ix_{table}_deleted", "deleted_at",
+                 postgresql_where=db.text("deleted_at IS NOT NULL"), sqlite_where=db.text("deleted_at IS NOT NULL")),
+    )
+
+class User(SoftDeleteMixin, db.Model):
+    # Only live users hold their email, so a deleted user's email can be registered again right away
+    __table_args__ = soft_delete_indexes("user") + (
+        db.Index("ix_user_email_live", "email", unique=True,
+                 postgresql_where=db.text("deleted_at IS NULL"), sqlite_where=db.text("deleted_at IS NULL")),
+    )
 
-db = SQLAlchemy()
-
-class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    email = db.Column(db.String(120), nullable=False)
     password = db.Column(db.String(80), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
 
@@ -20,12 +52,16 @@ class User(db.Model):
             # do not serialize the password, it's a security breach
         }
 
-class Character(db.Model):
+class Character(SoftDeleteMixin, db.Model):
+    __table_args__ = soft_delete_indexes("character")
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     description = db.Column(db.String(250))
     gender = db.Column(db.String(20), nullable=False)
     hair_color = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.text("CURRENT_TIMESTAMP"))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.text("CURRENT_TIMESTAMP"))
 
     favorites = db.relationship("Favorite", back_populates="character")
 
@@ -38,12 +74,16 @@ class Character(db.Model):
             "hair_color": self.hair_color,
         }
 
-class Planet(db.Model):
+class Planet(SoftDeleteMixin, db.Model):
+    __table_args__ = soft_delete_indexes("planet")
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), nullable=False)
     climate = db.Column(db.String(250))
     terrain = db.Column(db.String(250))
     population = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.text("CURRENT_TIMESTAMP"))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.text("CURRENT_TIMESTAMP"))
  
     favorites = db.relationship("Favorite", back_populates="planet")
 
@@ -56,11 +96,15 @@ class Planet(db.Model):
             "population": self.population
         }
     
-class Vehicle(db.Model):
+class Vehicle(SoftDeleteMixin, db.Model):
+    __table_args__ = soft_delete_indexes("vehicle")
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(25), nullable=False)
     cargo_capacity = db.Column(db.Integer)
     length = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.text("CURRENT_TIMESTAMP"))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.text("CURRENT_TIMESTAMP"))
 
     favorites = db.relationship("Favorite", back_populates="vehicle")
 
@@ -95,4 +139,56 @@ class Favorite(db.Model):
             "character_id": self.character_id,
             "planet_id": self.planet_id,
             "vehicle_id": self.vehicle_id
-        }
\ No newline at end of file
+        }
+
+
+class Change(db.Model):
+    # Change log read by /changes, id is the sequence number used as sync token
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def serialize(self):
+        return {
+            "seq": self.id,
+            "entity": self.entity,
+            "id": self.entity_id,
+            "operation": self.operation,
+            "changed_at": self.changed_at.isoformat()
+        }
+
+# Entities tracked by the change log, keyed by the name used in the API
+TRACKED_ENTITIES = {
+    "people": Character,
+    "planets": Planet,
+    "vehicles": Vehicle,
+}
+
+# Key of the Postgres advisory lock that serializes writers of the change log
+CHANGE_LOG_LOCK = 7316001
+
+def _record_change(entity, operation):
+    # Runs inside the flush, so the log row commits (or rolls back) with the change itself
+    def listener(mapper, connection, target):
+        # after_update also fires for objects that were only touched, skip those
+        if operation == "update" and not object_session(target).is_modified(target, include_collections=False):
+            return
+        # Held until commit, so sequence numbers are handed out in commit order and a client
+        # token can never move past a lower number that is still uncommitted. SQLite already
+        # serializes writers with its database lock
+        if connection.dialect.name == "postgresql":
+            connection.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_LOG_LOCK})
+        connection.execute(Change.__table__.insert().values(
+            entity=entity,
+            entity_id=target.id,
+            operation="delete" if target.deleted_at is not None else operation,
+            changed_at=datetime.utcnow()
+        ))
+    return listener
+
+for entity, model in TRACKED_ENTITIES.items():
+    event.listen(model, "after_insert", _record_change(entity, "insert"))
+    event.listen(model, "after_update", _record_change(entity, "update"))
+    event.listen(model, "after_delete", _record_change(entity, "delete"))
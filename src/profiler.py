@@ -0,0 +1,202 @@
+"""
+Opt-in request profiling. Only active when PROFILE_TOKEN is set: a request is
+profiled when it sends X-Profile-Token with that value, or when it falls in the
+PROFILE_SAMPLE_RATE fraction. Captures (stacks + SQL trace) are kept in a
+bounded directory and listed, slowest first, by GET /profiles.
+"""
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import random
+import cProfile
+import threading
+from collections import Counter
+from flask import g, has_request_context, jsonify, request, send_from_directory
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CAPTURE_NAME = re.compile(r"^[\w.-]+$")
+MAX_SQL_STATEMENTS = 200
+
+class StackSampler:
+    """Samples the stack of one thread and aggregates it in collapsed-stack format."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self):
+        # One "frame;frame;frame count" line per stack, readable by speedscope and flamegraph.pl
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class CaptureStore:
+    """Ring buffer of captures on disk, the oldest ones are removed past max_entries."""
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, metadata, write_profile, extension):
+        name = f"{time.time():.6f}-{os.getpid()}-{threading.get_ident()}"
+        metadata["file"] = name + extension
+        write_profile(os.path.join(self.directory, metadata["file"]))
+        with open(os.path.join(self.directory, name + ".json"), "w") as file:
+            json.dump(metadata, file)
+        self._trim()
+
+    def _trim(self):
+        entries = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in entries[:-self.max_entries]:
+            metadata = self.load(name)
+            for filename in (name, metadata.get("file") if metadata else None):
+                if filename:
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except FileNotFoundError:
+                        pass
+
+    def load(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def slowest(self):
+        captures = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                metadata = self.load(name)
+                if metadata is not None:
+                    metadata.pop("sql", None)
+                    captures.append(metadata)
+        return sorted(captures, key=lambda capture: capture["duration_ms"], reverse=True)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile" in g:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile" in g and conn.info.get("profile_query_start"):
+        elapsed = time.perf_counter() - conn.info["profile_query_start"].pop()
+        sql = g.profile["sql"]
+        if len(sql) < MAX_SQL_STATEMENTS:
+            sql.append({"statement": statement[:500], "duration_ms": round(elapsed * 1000, 3)})
+        g.profile["sql_ms"] += elapsed * 1000
+
+def setup_profiler(app):
+    token = os.getenv("PROFILE_TOKEN")
+    if not token:
+        # Nothing is registered, so there is no overhead at all when profiling is off
+        return
+
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+    default_mode = os.getenv("PROFILE_MODE", "sample")
+    interval = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+    store = CaptureStore(
+        os.getenv("PROFILE_DIR", "/tmp/profiles"),
+        int(os.getenv("PROFILE_MAX_ENTRIES", 50)),
+    )
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    def authorized():
+        # Compare bytes: compare_digest raises TypeError on non-ASCII str
+        return hmac.compare_digest(request.headers.get("X-Profile-Token", "").encode("utf-8"), token.encode("utf-8"))
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint in ("list_profiles", "get_profile"):
+            return
+        if not authorized() and not (sample_rate and random.random() < sample_rate):
+            return
+        mode = request.headers.get("X-Profile-Mode", default_mode)
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            mode = "sample"
+            profiler = StackSampler(threading.get_ident(), interval)
+            profiler.start()
+        g.profile = {"mode": mode, "profiler": profiler, "start": time.perf_counter(), "sql": [], "sql_ms": 0}
+
+    @app.after_request
+    def record_status(response):
+        if "profile" in g:
+            g.profile["status"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_profile(error=None):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        duration_ms = (time.perf_counter() - profile["start"]) * 1000
+        profiler = profile["profiler"]
+        if profile["mode"] == "cprofile":
+            profiler.disable()
+            write_profile, extension = profiler.dump_stats, ".prof"
+        else:
+            profiler.stop()
+            stacks = profiler.collapsed()
+
+            def write_profile(path):
+                with open(path, "w") as file:
+                    file.write(stacks)
+            extension = ".collapsed"
+
+        store.save({
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": profile.get("status", 500),
+            "mode": profile["mode"],
+            "captured_at": time.time(),
+            "duration_ms": round(duration_ms, 3),
+            "sql_count": len(profile["sql"]),
+            "sql_ms": round(profile["sql_ms"], 3),
+            "sql": profile["sql"],
+        }, write_profile, extension)
+
+    #Capturas ordenadas de la mas lenta a la mas rapida
+    @app.route('/profiles', methods=['GET'])
+    def list_profiles():
+        if not authorized():
+            return jsonify({"msg": "No autorizado"}), 401
+        return jsonify(store.slowest()), 200
+
+    #Descargar una captura (.collapsed, .prof o .json con la traza SQL)
+    @app.route('/profiles/<name>', methods=['GET'])
+    def get_profile(name):
+        if not authorized():
+            return jsonify({"msg": "No autorizado"}), 401
+        if not CAPTURE_NAME.match(name):
+            return jsonify({"msg": "Captura no encontrada"}), 404
+        return send_from_directory(store.directory, name)
@@ -0,0 +1,238 @@
+"""
+Per-client rate limiting (token buckets per endpoint class) and a concurrency cap
+(per worker, or across all workers with Redis) that sheds requests instead of
+letting them queue forever.
+"""
+import os
+import math
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from flask import g, jsonify, request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+FULL_LIST_ENDPOINTS = {"get_all_people", "get_all_planets", "get_all_users", "get_all_vehicles"}
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# Budgets are "requests/seconds", e.g. 120/60 lets a client burst 120 requests and refills 2 per second
+DEFAULT_BUDGETS = {
+    "cheap": "120/60",
+    "full_list": "20/60",
+    "write": "30/60",
+}
+
+REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 't'))
+local last = tonumber(redis.call('HGET', KEYS[1], 'l'))
+if tokens == nil then
+    tokens = capacity
+    last = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'l', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+# Leases expire so slots held by a worker that died are given back
+REDIS_ACQUIRE_SLOT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+def endpoint_class():
+    if request.method in WRITE_METHODS:
+        return "write"
+    # With ?ids= the list endpoints only load a bounded batch
+    if request.endpoint in FULL_LIST_ENDPOINTS and "ids" not in request.args:
+        return "full_list"
+    # The initial sync returns the full lists (since=latest) or the whole change log (since=0)
+    if request.endpoint == "get_changes" and request.args.get("since", "") in ("", "0", "latest"):
+        return "full_list"
+    return "cheap"
+
+def client_id():
+    # ProxyFix (TRUSTED_PROXIES) already replaced remote_addr with the client seen by our proxies
+    return request.remote_addr
+
+def parse_budget(value):
+    requests, seconds = value.split("/")
+    capacity = float(requests)
+    return capacity, capacity / float(seconds)
+
+
+class LocalBuckets:
+    """In-memory token buckets of this worker, the least recently seen clients are dropped first."""
+
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker, falls back to the local ones if Redis fails."""
+
+    def __init__(self, url, fallback):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05)
+        self.script = self.client.register_script(REDIS_TOKEN_BUCKET)
+        self.fallback = fallback
+
+    def take(self, key, capacity, rate):
+        try:
+            return float(self.script(keys=[f"ratelimit:{key}"], args=[capacity, rate, time.time()]))
+        except redis.RedisError as error:
+            print(f"Rate limit en Redis no disponible: {error}")
+            return self.fallback.take(key, capacity, rate)
+
+
+class LocalSlots:
+    """Concurrency cap of this worker."""
+
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def acquire(self, timeout):
+        return "local" if self._semaphore.acquire(timeout=timeout) else None
+
+    def release(self, lease):
+        self._semaphore.release()
+
+
+class RedisSlots:
+    """Concurrency cap shared by every worker and instance, falls back to the local one if Redis fails."""
+
+    def __init__(self, client, limit, lease_seconds, fallback):
+        self.client = client
+        self.limit = limit
+        self.lease_seconds = lease_seconds
+        self.script = client.register_script(REDIS_ACQUIRE_SLOT)
+        self.fallback = fallback
+
+    def acquire(self, timeout):
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                now = time.time()
+                if self.script(keys=["ratelimit:slots"], args=[now, self.limit, now + self.lease_seconds, lease]):
+                    return lease
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(0.02)
+        except redis.RedisError as error:
+            print(f"Limite de concurrencia en Redis no disponible: {error}")
+            return self.fallback.acquire(timeout)
+
+    def release(self, lease):
+        if lease == "local":
+            self.fallback.release(lease)
+            return
+        try:
+            self.client.zrem("ratelimit:slots", lease)
+        except redis.RedisError as error:
+            # The lease expires on its own
+            print(f"Limite de concurrencia en Redis no disponible: {error}")
+
+
+def worker_concurrency():
+    # Requests one gunicorn worker can have in flight, same settings as gunicorn.conf.py
+    worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+    if worker_class == "gevent":
+        return int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+    if worker_class == "gthread":
+        return int(os.getenv("GUNICORN_THREADS", 4))
+    return 1
+
+def too_busy(msg, retry_after, status_code):
+    response = jsonify({"msg": msg})
+    response.status_code = status_code
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def setup_rate_limit(app):
+    if os.getenv("RATELIMIT_ENABLED", "true").lower() in ("0", "false", "no"):
+        return
+
+    budgets = {
+        name: parse_budget(os.getenv(f"RATELIMIT_{name.upper()}", default))
+        for name, default in DEFAULT_BUDGETS.items()
+    }
+    max_queue_time = float(os.getenv("RATELIMIT_MAX_QUEUE_SECONDS", 2))
+    buckets = LocalBuckets()
+    redis_url = os.getenv("RATELIMIT_REDIS_URL")
+    if redis_url and redis is not None:
+        buckets = RedisBuckets(redis_url, buckets)
+        # With Redis the cap counts the requests of every worker (and instance) together
+        total = worker_concurrency() * int(os.getenv("WEB_CONCURRENCY", 1))
+        slots = RedisSlots(
+            buckets.client,
+            int(os.getenv("RATELIMIT_MAX_CONCURRENT", total)),
+            float(os.getenv("RATELIMIT_SLOT_LEASE_SECONDS", 60)),
+            LocalSlots(worker_concurrency()),
+        )
+    else:
+        slots = LocalSlots(int(os.getenv("RATELIMIT_MAX_CONCURRENT", worker_concurrency())))
+
+    @app.before_request
+    def limit_request():
+        if request.method == "OPTIONS":
+            return None
+
+        # Drop requests that already waited too long in the router/gunicorn backlog
+        request_start = request.headers.get("X-Request-Start", "").replace("t=", "")
+        if request_start.isdigit():
+            queued = time.time() - int(request_start) / (1000 if len(request_start) <= 13 else 1000000)
+            if queued > max_queue_time:
+                return too_busy("Servidor ocupado, intenta de nuevo", 1, 503)
+
+        name = endpoint_class()
+        capacity, rate = budgets[name]
+        wait = buckets.take(f"{name}:{client_id()}", capacity, rate)
+        if wait > 0:
+            return too_busy("Demasiadas peticiones", wait, 429)
+
+        lease = slots.acquire(timeout=max_queue_time)
+        if lease is None:
+            return too_busy("Servidor ocupado, intenta de nuevo", 1, 503)
+        g.rate_limit_slot = lease
+        return None
+
+    @app.teardown_request
+    def release_slot(error=None):
+        lease = g.pop("rate_limit_slot", None)
+        if lease is not None:
+            slots.release(lease)
@@ -0,0 +1,84 @@
+"""
+Background cleanup of soft deleted rows: removes the favorites that point to them
+and then hard deletes them, in bounded batches so no transaction grows with the
+number of favorites.
+"""
+import os
+import time
+import threading
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, User, Character, Planet, Vehicle, Favorite
+
+REAPED_MODELS = (
+    (User, Favorite.user_id),
+    (Character, Favorite.character_id),
+    (Planet, Favorite.planet_id),
+    (Vehicle, Favorite.vehicle_id),
+)
+
+def reap_batch(batch_size):
+    """Run one bounded round over every model, returns how many rows were removed."""
+    removed = 0
+    for model, favorite_column in REAPED_MODELS:
+        ids = [id for (id,) in db.session.query(model.id).filter(model.deleted_at.isnot(None)).limit(batch_size)]
+        if not ids:
+            continue
+        try:
+            favorite_ids = [id for (id,) in db.session.query(Favorite.id).filter(favorite_column.in_(ids)).limit(batch_size)]
+            if favorite_ids:
+                Favorite.query.filter(Favorite.id.in_(favorite_ids)).delete(synchronize_session=False)
+                removed += len(favorite_ids)
+            # A full batch of favorites means there may be more left, the rows wait for the next round
+            if len(favorite_ids) < batch_size:
+                removed += model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except SQLAlchemyError as error:
+            # e.g. a favorite was added to a deleted row meanwhile, retried in the next round
+            db.session.rollback()
+            print(f"Reaper: error limpiando {model.__name__}: {error}")
+    return removed
+
+def run_reaper(app, batch_size, interval):
+    while True:
+        with app.app_context():
+            try:
+                removed = reap_batch(batch_size)
+            except SQLAlchemyError as error:
+                print(f"Reaper: error: {error}")
+                removed = 0
+            finally:
+                db.session.remove()
+        # Keep going while there is backlog, otherwise wait for the next interval
+        time.sleep(0.1 if removed else interval)
+
+def setup_reaper(app):
+    batch_size = int(os.getenv("REAPER_BATCH_SIZE", 500))
+    interval = float(os.getenv("REAPER_INTERVAL", 30))
+
+    @app.cli.command("reap")
+    def reap_command():
+        """Purge soft deleted rows and their favorites."""
+        total = 0
+        while True:
+            removed = reap_batch(batch_size)
+            total += removed
+            if not removed:
+                break
+        print(f"{total} filas eliminadas")
+
+    if os.getenv("REAPER_ENABLED", "true").lower() in ("0", "false", "no"):
+        return
+
+    # Threads don't survive fork, so start one lazily in each worker process
+    state = {"pid": None}
+    lock = threading.Lock()
+
+    @app.before_request
+    def start_reaper():
+        if state["pid"] == os.getpid():
+            return
+        with lock:
+            if state["pid"] != os.getpid():
+                thread = threading.Thread(target=run_reaper, args=(app, batch_size, interval), daemon=True)
+                thread.start()
+                state["pid"] = os.getpid()
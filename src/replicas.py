@@ -0,0 +1,161 @@
+"""
+Read-replica routing: GET requests read from the replicas listed in
+READ_REPLICA_URLS, everything else (and any read after a write) uses the primary.
+"""
+import os
+import time
+import itertools
+import threading
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # Flushes are writes, so they always go to the primary
+        if bind is None and not self._flushing and _reads_from_replica():
+            engine = _request_replica(self._db)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, "after_flush")
+def _pin_to_primary(session, flush_context):
+    # Read-after-write: once this request wrote something, keep reading from the primary
+    if has_request_context():
+        g.db_wrote = True
+
+def _reads_from_replica():
+    return (has_request_context() and g.get("db_read_only", False)
+            and not g.get("db_wrote", False) and not g.get("db_primary", False))
+
+def use_primary():
+    # For reads that must never see an older state than a previous request did (e.g. sync tokens)
+    g.db_primary = True
+
+def _request_replica(db):
+    # Pick one replica per request so every query in it sees the same snapshot
+    if "db_replica" not in g:
+        pool = current_app.extensions.get("replicas")
+        g.db_replica = pool.choose() if pool is not None else None
+    if g.db_replica is None:
+        return None
+    return db.engines[g.db_replica]
+
+
+class ReplicaPool:
+
+    def __init__(self, urls, health_interval, max_lag, connect_timeout, statement_timeout):
+        self.urls = urls
+        self.keys = list(urls)
+        self.health_interval = health_interval
+        self.max_lag = max_lag
+        self.connect_timeout = connect_timeout
+        self.statement_timeout = statement_timeout
+        self._counter = itertools.count()
+        self._health = {}
+        self._check_engines = {}
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def choose(self):
+        # Round-robin over the healthy replicas, None means "use the primary".
+        # Only reads the results of the background checks, never touches the network
+        start = next(self._counter)
+        for offset in range(len(self.keys)):
+            key = self.keys[(start + offset) % len(self.keys)]
+            if self._health.get(key, False):
+                return key
+        return None
+
+    def start(self):
+        # Threads don't survive fork, so each worker process starts its own checker
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._check_engines = {}
+                threading.Thread(target=self._run, daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        # Checks run one after another here, requests only ever read self._health
+        while True:
+            for key in self.keys:
+                self._health[key] = self._check(key)
+            time.sleep(self.health_interval)
+
+    def _check_engine(self, key):
+        # Separate unpooled engine, so the timeouts only apply to the health check
+        if key not in self._check_engines:
+            url = self.urls[key]
+            connect_args = {}
+            if url.startswith(("postgresql", "mysql")):
+                connect_args["connect_timeout"] = self.connect_timeout
+            if url.startswith("postgresql"):
+                connect_args["options"] = f"-c statement_timeout={int(self.statement_timeout * 1000)}"
+            self._check_engines[key] = create_engine(url, poolclass=NullPool, connect_args=connect_args)
+        return self._check_engines[key]
+
+    def _check(self, key):
+        try:
+            engine = self._check_engine(key)
+            with engine.connect() as connection:
+                if engine.dialect.name != "postgresql":
+                    connection.execute(text("SELECT 1"))
+                    return True
+                # A replica that is still streaming WAL and replayed everything it received is
+                # caught up, even if the last replayed transaction is old because the primary has
+                # been idle. Without an active stream the received position can be stale, so the
+                # age of the last replayed transaction is used (NULL, never replayed: unhealthy)
+                lag = connection.execute(text(
+                    "SELECT CASE "
+                    "WHEN NOT pg_is_in_recovery() THEN 0 "
+                    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+                    "AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                )).scalar()
+                return lag is not None and float(lag) <= self.max_lag
+        except Exception as error:
+            print(f"Replica {key} no disponible: {error}")
+            return False
+
+
+def configure_replicas(app):
+    # Must run before db.init_app so the replica engines are created as binds
+    urls = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    connect_timeout = int(os.getenv("REPLICA_CONNECT_TIMEOUT", 2))
+    keys = []
+    for index, url in enumerate(urls):
+        key = f"replica_{index}"
+        url = url.replace("postgres://", "postgresql://")
+        options = {"url": url}
+        # Fail fast on a replica that drops packets instead of waiting for the OS TCP timeout
+        if url.startswith(("postgresql", "mysql")):
+            options["connect_args"] = {"connect_timeout": connect_timeout}
+        binds[key] = options
+        keys.append(key)
+    return keys
+
+def setup_replicas(app, keys):
+    if not keys:
+        return
+    binds = app.config["SQLALCHEMY_BINDS"]
+    pool = ReplicaPool(
+        {key: binds[key]["url"] for key in keys},
+        health_interval=float(os.getenv("REPLICA_HEALTH_INTERVAL", 5)),
+        max_lag=float(os.getenv("REPLICA_MAX_LAG", 5)),
+        connect_timeout=int(os.getenv("REPLICA_CONNECT_TIMEOUT", 2)),
+        statement_timeout=float(os.getenv("REPLICA_CHECK_TIMEOUT", 2)),
+    )
+    app.extensions["replicas"] = pool
+
+    @app.before_request
+    def route_reads_to_replicas():
+        pool.start()
+        g.db_read_only = request.method in READ_METHODS
@@ -1,4 +1,5 @@
 from flask import jsonify, url_for
+from sqlalchemy.orm.util import identity_key
 
 class APIException(Exception):
     status_code = 400
@@ -12,7 +13,7 @@ class APIException(Exception):
 
     def to_dict(self):
         rv = dict(self.payload or ())
-        rv['message'] = self.message
+        rv['msg'] = self.message
         return rv
 
 def has_no_empty_params(rule):
@@ -39,3 +40,39 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+MAX_IDS_PER_REQUEST = 100
+
+def parse_ids(raw):
+    # "1,2,3" -> [1, 2, 3] keeping the order and dropping repeated ids
+    try:
+        ids = [int(value) for value in raw.split(",") if value.strip()]
+    except ValueError:
+        raise APIException("El parametro ids debe ser una lista de enteros separados por comas", status_code=400)
+    if not ids:
+        raise APIException("El parametro ids no puede estar vacio", status_code=400)
+    if len(ids) > MAX_IDS_PER_REQUEST:
+        raise APIException(f"Maximo {MAX_IDS_PER_REQUEST} ids por peticion", status_code=400)
+    return list(dict.fromkeys(ids))
+
+def get_many(session, model, ids):
+    # Objects already in the session's identity map are reused, the rest come in a single IN query
+    found = {}
+    for id in ids:
+        instance = session.identity_map.get(identity_key(model, id))
+        if instance is not None:
+            found[id] = instance
+    missing = [id for id in ids if id not in found]
+    if missing:
+        for instance in session.query(model).filter(model.id.in_(missing)):
+            found[instance.id] = instance
+    # Soft deleted rows count as missing
+    found = {id: instance for id, instance in found.items() if getattr(instance, "deleted_at", None) is None}
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
+
+def serialize_many(session, model, raw_ids):
+    instances, missing = get_many(session, model, parse_ids(raw_ids))
+    return jsonify({
+        "results": [instance.serialize() for instance in instances],
+        "missing": missing
+    })